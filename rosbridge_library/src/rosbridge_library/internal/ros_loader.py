@@ -31,9 +31,12 @@
 # ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 
-import importlib
+import functools
 import re
-from threading import Lock
+import sys
+import time
+from collections import OrderedDict
+from importlib import import_module
 
 """ ros_loader contains methods for dynamically loading ROS message classes at
 runtime.  It's achieved by using roslib to load the manifest files for the
@@ -42,19 +45,42 @@ package that the respective class is contained in.
 Methods typically return the requested class or instance, or None if not found
 """
 
-# Variable containing the loaded classes
+# Variable containing the loaded classes, keyed by normalised typestring
 _loaded_msgs = {}
 _loaded_srvs = {}
-_msgs_lock = Lock()
-_srvs_lock = Lock()
+# Variable mapping requested typestrings to their normalised typestring,
+# oldest first. Clients may send any number of spellings of the same type,
+# so only the most recent _alias_cache_size are kept.
+_msg_aliases = OrderedDict()
+_srv_aliases = OrderedDict()
+_alias_cache_size = 4096
+# Variable containing the exception type, args and expiry time of failed
+# lookups, oldest first. Malformed typestrings never expire, while failed
+# imports are retried after _failed_import_ttl seconds since the interfaces
+# may become available later.
+_failed_msgs = OrderedDict()
+_failed_srvs = OrderedDict()
+_failed_cache_size = 1024
+_failed_import_ttl = 5.0
+
+# Suffixes of the hidden services that are autogenerated for actions
+_autogenerated_suffixes = ("_SendGoal", "_GetResult")
+# Positions in a CamelCase name where a snake_case underscore belongs
+_camel_case_boundaries = re.compile("((?<=[a-z0-9])[A-Z]|(?!^)[A-Z](?=[a-z]))")
+# Sentinel for attribute lookups that may legitimately fail
+_missing = object()
 
 
 class InvalidTypeStringException(Exception):
+    __slots__ = ()
+
     def __init__(self, typestring):
         Exception.__init__(self, "%s is not a valid type string" % typestring)
 
 
 class InvalidModuleException(Exception):
+    __slots__ = ()
+
     def __init__(self, modname, subname, original_exception):
         Exception.__init__(
             self,
@@ -64,6 +90,8 @@ class InvalidModuleException(Exception):
 
 
 class InvalidActionInterfaceException(Exception):
+    __slots__ = ()
+
     def __init__(self, classname):
         Exception.__init__(
             self,
@@ -72,6 +100,8 @@ class InvalidActionInterfaceException(Exception):
 
 
 class InvalidClassException(Exception):
+    __slots__ = ()
+
     def __init__(self, modname, subname, classname, original_exception):
         Exception.__init__(
             self,
@@ -80,18 +110,20 @@ class InvalidClassException(Exception):
         )
 
 
+@functools.lru_cache(maxsize=4096)
 def get_message_class(typestring):
     """Loads the message type specified.
 
     Returns the loaded class, or throws exceptions on failure"""
-    return _get_msg_class(typestring)
+    return _get_or_raise_failed(_get_msg_class, typestring, _failed_msgs)
 
 
+@functools.lru_cache(maxsize=4096)
 def get_service_class(typestring):
     """Loads the service type specified.
 
     Returns the loaded class, or None on failure"""
-    return _get_srv_class(typestring)
+    return _get_or_raise_failed(_get_srv_class, typestring, _failed_srvs)
 
 
 def get_message_instance(typestring):
@@ -111,26 +143,74 @@ def get_service_response_instance(typestring):
     return cls.Response()
 
 
+def clear_cache():
+    """Forgets all loaded classes and failed lookups, so that subsequent
+    calls load the requested types again"""
+    get_message_class.cache_clear()
+    get_service_class.cache_clear()
+    _parse_typestring.cache_clear()
+    _get_hidden_action_subname.cache_clear()
+    for cache in (
+        _loaded_msgs,
+        _loaded_srvs,
+        _msg_aliases,
+        _srv_aliases,
+        _failed_msgs,
+        _failed_srvs,
+    ):
+        cache.clear()
+
+
+def _get_or_raise_failed(get_class, typestring, failed):
+    """Returns get_class(typestring), remembering the exception if it fails.
+
+    Repeated lookups of a typestring that failed before raise a new exception
+    with the same type and message instead of going through the import
+    machinery again. Only the type and args are kept, so cached failures hold
+    no tracebacks. Failures that depend only on the typestring are kept for
+    good, failed imports expire after _failed_import_ttl seconds. At most
+    _failed_cache_size failures are kept, the oldest are dropped first. Use
+    clear_cache() to forget them."""
+    failure = failed.get(typestring)
+    if failure is not None:
+        exc_type, args, expires = failure
+        if expires is None or time.monotonic() < expires:
+            # The exception constructors take the parts of the message rather
+            # than the message, so create the instance from its args directly
+            raise exc_type.__new__(exc_type, *args)
+        failed.pop(typestring, None)
+
+    try:
+        return get_class(typestring)
+    except (InvalidTypeStringException, InvalidActionInterfaceException) as exc:
+        _add_to_bounded_cache(failed, typestring, (type(exc), exc.args, None), _failed_cache_size)
+        raise
+    except (InvalidModuleException, InvalidClassException) as exc:
+        expires = time.monotonic() + _failed_import_ttl
+        _add_to_bounded_cache(
+            failed, typestring, (type(exc), exc.args, expires), _failed_cache_size
+        )
+        raise
+
+
 def _get_msg_class(typestring):
     """If not loaded, loads the specified msg class then returns an instance
     of it
 
     Throws various exceptions if loading the msg class fails"""
-    global _loaded_msgs, _msgs_lock
+    # The type string starts with the package and ends with the
+    # class and contains module subnames in between. For
+    # compatibility with ROS1 style types, we fall back to use a
+    # standard "msg" subname.
+    _, subname, _, _ = _parse_typestring(typestring)
+    if subname is None or subname == "msg":
+        # There is only one subname to try, so skip the fallback
+        return _get_class(typestring, "msg", _loaded_msgs, _msg_aliases)
+
     try:
-        # The type string starts with the package and ends with the
-        # class and contains module subnames in between. For
-        # compatibility with ROS1 style types, we fall back to use a
-        # standard "msg" subname.
-        splits = [x for x in typestring.split("/") if x]
-        if len(splits) > 2:
-            subname = ".".join(splits[1:-1])
-        else:
-            subname = "msg"
-
-        return _get_class(typestring, subname, _loaded_msgs, _msgs_lock)
+        return _get_class(typestring, subname, _loaded_msgs, _msg_aliases)
     except (InvalidModuleException, InvalidClassException):
-        return _get_class(typestring, "msg", _loaded_msgs, _msgs_lock)
+        return _get_class(typestring, "msg", _loaded_msgs, _msg_aliases)
 
 
 def _get_srv_class(typestring):
@@ -138,57 +218,68 @@ def _get_srv_class(typestring):
     of it
 
     Throws various exceptions if loading the srv class fails"""
-    global _loaded_srvs, _srvs_lock
+    # The type string starts with the package and ends with the
+    # class and contains module subnames in between. For
+    # compatibility with ROS1 style types, we fall back to use a
+    # standard "srv" subname.
+    _, subname, classname, is_action = _parse_typestring(typestring)
+    if subname is None or subname == "srv":
+        # There is only one subname to try, so skip the fallback
+        return _get_class(typestring, "srv", _loaded_srvs, _srv_aliases)
+    if is_action:
+        # The internal action interfaces use hidden service types.
+        # Identification happens when the first part of the subname
+        # equals "action"
+        subname = _get_hidden_action_subname(subname, classname)
+
     try:
-        # The type string starts with the package and ends with the
-        # class and contains module subnames in between. For
-        # compatibility with ROS1 style types, we fall back to use a
-        # standard "srv" subname.
-        splits = [x for x in typestring.split("/") if x]
-        if len(splits) > 2:
-            subname = ".".join(splits[1:-1])
-            if splits[1] == "action":
-                # The internal action interfaces use hidden service types.
-                # Identification happens when the first part of the subname
-                # equals "action"
-                subname = _get_hidden_action_subname(subname, splits[-1])
-        else:
-            subname = "srv"
-        return _get_class(typestring, subname, _loaded_srvs, _srvs_lock)
+        return _get_class(typestring, subname, _loaded_srvs, _srv_aliases)
     except (InvalidModuleException, InvalidClassException):
-        return _get_class(typestring, "srv", _loaded_srvs, _srvs_lock)
+        return _get_class(typestring, "srv", _loaded_srvs, _srv_aliases)
 
 
-def _get_class(typestring, subname, cache, lock):
+def _get_class(typestring, subname, cache, aliases):
     """If not loaded, loads the specified class then returns an instance
     of it.
 
-    Loaded classes are cached in the provided cache dict
+    Loaded classes are cached in the provided cache dict under their
+    normalised typestring, and aliases maps recently requested typestrings to
+    that key. Both are read without locking since dict reads are atomic;
+    concurrent loads of the same type resolve to the same class object, so
+    the first write wins.
 
     Throws various exceptions if loading the msg class fails"""
 
     # First, see if we have this type string cached
-    cls = _get_from_cache(cache, lock, typestring)
+    cls = cache.get(aliases.get(typestring, typestring))
     if cls is not None:
         return cls
 
     # Now normalise the typestring
-    modname, classname = _splittype(typestring)
-    norm_typestring = modname + "/" + classname
-
-    # Check to see if the normalised type string is cached
-    cls = _get_from_cache(cache, lock, norm_typestring)
-    if cls is not None:
-        return cls
-
-    # Load the class
-    cls = _load_class(modname, subname, classname)
+    modname, _, classname, _ = _parse_typestring(typestring)
+    norm_typestring = sys.intern(modname + "/" + classname)
+
+    # Check to see if the normalised type string is cached, otherwise load
+    # the class and cache it under the normalised typestring
+    cls = cache.get(norm_typestring)
+    if cls is None:
+        cls = cache.setdefault(norm_typestring, _load_class(modname, subname, classname))
+
+    # Normalised typestrings are looked up directly and need no alias
+    if typestring != norm_typestring:
+        _add_to_bounded_cache(aliases, typestring, norm_typestring, _alias_cache_size)
+    return cls
 
-    # Cache the class for both the regular and normalised typestring
-    _add_to_cache(cache, lock, typestring, cls)
-    _add_to_cache(cache, lock, norm_typestring, cls)
 
-    return cls
+def _add_to_bounded_cache(cache, key, value, size):
+    """Adds key to the OrderedDict cache, dropping the oldest entries so that
+    at most size entries are kept"""
+    while key not in cache and len(cache) >= size:
+        try:
+            cache.popitem(last=False)
+        except KeyError:
+            break
+    cache[key] = value
 
 
 def _load_class(modname, subname, classname):
@@ -200,71 +291,68 @@ def _load_class(modname, subname, classname):
 
     Returns the loaded module, or None on failure"""
 
-    # This assumes the module is already in the path.
-    try:
-        pypkg = importlib.import_module(f"{modname}.{subname}")
-    except Exception as exc:
-        raise InvalidModuleException(modname, subname, exc)
-
-    try:
-        return getattr(pypkg, classname)
-    except Exception as exc:
-        raise InvalidClassException(modname, subname, classname, exc)
+    # Modules that are already imported are taken straight from sys.modules,
+    # unless another thread is still executing them, in which case the import
+    # machinery waits for it to finish.
+    pkgname = f"{modname}.{subname}"
+    pypkg = sys.modules.get(pkgname)
+    if pypkg is None or getattr(getattr(pypkg, "__spec__", None), "_initializing", False):
+        # This assumes the module is already in the path.
+        try:
+            pypkg = import_module(pkgname)
+        except Exception as exc:
+            raise InvalidModuleException(modname, subname, exc)
+
+    cls = getattr(pypkg, classname, _missing)
+    if cls is _missing:
+        raise InvalidClassException(
+            modname,
+            subname,
+            classname,
+            AttributeError(f"module '{pkgname}' has no attribute '{classname}'"),
+        )
+    return cls
 
 
-def _splittype(typestring):
+@functools.lru_cache(maxsize=4096)
+def _parse_typestring(typestring):
     """Split the string the / delimiter and strip out empty strings
 
+    Returns a (modname, subname, classname, is_action) tuple. subname holds
+    the dotted module subnames between package and class, or None if there
+    are none. is_action is set if the first module subname is "action".
+
     Performs similar logic to roslib.names.package_resource_name but is a bit
     more forgiving about excess slashes
     """
     splits = [x for x in typestring.split("/") if x]
-    if len(splits) == 3:
-        return (splits[0], splits[2])
     if len(splits) == 2:
-        return (splits[0], splits[1])
+        return (splits[0], None, splits[1], False)
+    if len(splits) == 3:
+        return (splits[0], splits[1], splits[2], splits[1] == "action")
     if len(splits) == 4 and splits[1] == "action":
         # Special case for hidden services that are autogenerated for actions
-        return (splits[0], splits[3])
+        return (splits[0], splits[1] + "." + splits[2], splits[3], True)
     raise InvalidTypeStringException(typestring)
 
 
-def _add_to_cache(cache, lock, key, value):
-    lock.acquire()
-    cache[key] = value
-    lock.release()
-
-
-def _get_from_cache(cache, lock, key):
-    """Returns the value for the specified key from the cache.
-    Locks the lock before doing anything. Returns None if key not in cache"""
-    lock.acquire()
-    ret = None
-    if key in cache:
-        ret = cache[key]
-    lock.release()
-    return ret
-
-
+@functools.lru_cache(maxsize=1024)
 def _get_hidden_action_subname(subname: str, classname: str) -> str:
     """Returns an extended subname if necessary.
     If the subname doesn't contain the hidden submodule suffix, the suffix
     is added to the subname"""
-    if len(subname.split("._")) == 2:
+    if "._" in subname:
         # there is already a hidden submodule specified.
         # Nothing to do here
         return subname
 
-    def remove_autogenerated_suffixes(classname: str) -> str:
-        autogenerated_suffixes = ["_SendGoal", "_GetResult"]
-        for s in autogenerated_suffixes:
-            if classname.endswith(s):
-                return classname[0 : -len(s)]
-        raise InvalidActionInterfaceException(classname)
-
-    def camel_to_snake_case(camel):
-        return re.sub("((?<=[a-z0-9])[A-Z]|(?!^)[A-Z](?=[a-z]))", r"_\1", camel).lower()
+    action_name = _remove_autogenerated_suffixes(classname)
+    snake = _camel_case_boundaries.sub(r"_\1", action_name).lower()
+    return f"{subname}._{snake}"
 
-    private_submodule = "._" + camel_to_snake_case(remove_autogenerated_suffixes(classname))
 
-    return subname + private_submodule
+def _remove_autogenerated_suffixes(classname: str) -> str:
+    if not classname.endswith(_autogenerated_suffixes):
+        raise InvalidActionInterfaceException(classname)
+    # Both suffixes start with the last underscore of the class name
+    return classname[: classname.rindex("_")]
@@ -1,5 +1,9 @@
 #!/usr/bin/env python
+import sys
+import time
+import types
 import unittest
+from unittest.mock import patch
 
 from rosbridge_library.internal import ros_loader
 from rosidl_runtime_py.utilities import get_message
@@ -124,6 +128,24 @@ class TestROSLoader(unittest.TestCase):
             self.assertEqual(get_message(x), type(inst))
             self.assertTrue(x in ros_loader._loaded_msgs)
 
+    def test_alias_cache_bounded(self):
+        ros_loader.clear_cache()
+        spellings = [
+            "std_msgs" + "/" * i + "String" for i in range(1, ros_loader._alias_cache_size + 100)
+        ]
+        for x in spellings:
+            self.assertNotEqual(ros_loader.get_message_class(x), None)
+        self.assertEqual(len(ros_loader._msg_aliases), ros_loader._alias_cache_size)
+        self.assertEqual(list(ros_loader._loaded_msgs), ["std_msgs/String"])
+
+        # Adding an alias that is already cached doesn't evict another one
+        oldest = next(iter(ros_loader._msg_aliases))
+        ros_loader._add_to_bounded_cache(
+            ros_loader._msg_aliases, spellings[-1], "std_msgs/String", ros_loader._alias_cache_size
+        )
+        self.assertTrue(oldest in ros_loader._msg_aliases)
+        ros_loader.clear_cache()
+
     def test_assorted_msgnames(self):
         assortedmsgs = [
             "geometry_msgs/Pose",
@@ -208,6 +230,56 @@ class TestROSLoader(unittest.TestCase):
             self.assertRaises(ros_loader.InvalidClassException, ros_loader.get_message_class, x)
             self.assertRaises(ros_loader.InvalidClassException, ros_loader.get_message_instance, x)
 
+    def test_failed_cache(self):
+        failing = [
+            ("wangle_msgs/Jam", ros_loader.InvalidModuleException),
+            ("std_msgs/Spool", ros_loader.InvalidClassException),
+            ("stillbad", ros_loader.InvalidTypeStringException),
+        ]
+        for x, exc in failing:
+            ros_loader.clear_cache()
+            with self.assertRaises(exc) as first:
+                ros_loader.get_message_class(x)
+            self.assertTrue(x in ros_loader._failed_msgs)
+            with patch.object(ros_loader, "_load_class") as load_class, patch.object(
+                ros_loader, "import_module"
+            ) as import_module:
+                with self.assertRaises(exc) as second:
+                    ros_loader.get_message_class(x)
+                load_class.assert_not_called()
+                import_module.assert_not_called()
+            self.assertIsNot(first.exception, second.exception)
+            self.assertEqual(str(first.exception), str(second.exception))
+        ros_loader.clear_cache()
+        self.assertFalse(ros_loader._failed_msgs)
+
+    def test_failed_cache_expires(self):
+        ros_loader.clear_cache()
+        x = "late_msgs/Thing"
+        self.assertRaises(ros_loader.InvalidModuleException, ros_loader.get_message_class, x)
+
+        late_msgs = types.ModuleType("late_msgs.msg")
+        late_msgs.Thing = type("Thing", (), {})
+        later = time.monotonic() + ros_loader._failed_import_ttl + 1
+        with patch.dict(sys.modules, {"late_msgs.msg": late_msgs}):
+            # The failed import is remembered until it expires
+            self.assertRaises(ros_loader.InvalidModuleException, ros_loader.get_message_class, x)
+            with patch.object(ros_loader.time, "monotonic", return_value=later):
+                self.assertIs(ros_loader.get_message_class(x), late_msgs.Thing)
+                # Malformed type strings stay failed
+                self.assertRaises(
+                    ros_loader.InvalidTypeStringException, ros_loader.get_message_class, "stillbad"
+                )
+                self.assertTrue("stillbad" in ros_loader._failed_msgs)
+        ros_loader.clear_cache()
+
+    def test_non_module_in_sys_modules(self):
+        ros_loader.clear_cache()
+        weird_msgs = types.SimpleNamespace(Thing=type("Thing", (), {}))
+        with patch.dict(sys.modules, {"weird_msgs.msg": weird_msgs}):
+            self.assertIs(ros_loader.get_message_class("weird_msgs/Thing"), weird_msgs.Thing)
+        ros_loader.clear_cache()
+
     def test_bad_servicenames(self):
         bad = [
             "",
@@ -333,6 +405,25 @@ class TestROSLoader(unittest.TestCase):
                 ros_loader.InvalidClassException, ros_loader.get_service_response_instance, x
             )
 
+    def test_clear_cache(self):
+        self.assertEqual(ros_loader.get_message_class.cache_info().maxsize, 4096)
+        self.assertEqual(ros_loader.get_service_class.cache_info().maxsize, 4096)
+
+        msg_class = ros_loader.get_message_class("std_msgs/String")
+        srv_class = ros_loader.get_service_class("std_srvs/Empty")
+        ros_loader.clear_cache()
+        self.assertEqual(ros_loader.get_message_class.cache_info().currsize, 0)
+        self.assertEqual(ros_loader.get_service_class.cache_info().currsize, 0)
+        self.assertFalse(ros_loader._loaded_msgs)
+        self.assertFalse(ros_loader._loaded_srvs)
+
+        self.assertIs(ros_loader.get_message_class("std_msgs/String"), msg_class)
+        self.assertIs(ros_loader.get_service_class("std_srvs/Empty"), srv_class)
+        self.assertEqual(ros_loader.get_message_class.cache_info().currsize, 1)
+        self.assertEqual(ros_loader.get_service_class.cache_info().currsize, 1)
+        self.assertTrue("std_msgs/String" in ros_loader._loaded_msgs)
+        self.assertTrue("std_srvs/Empty" in ros_loader._loaded_srvs)
+
     def test_hidden_services_for_actions(self):
         hidden_services = [
             "example_interfaces/action/Fibonacci_GetResult",
@@ -343,8 +434,7 @@ class TestROSLoader(unittest.TestCase):
             "rosbridge_test_msgs/action/_complex_name/ComplexName_GetResult",
         ]
         for x in hidden_services:
-            ros_loader._loaded_msgs = {}
-            ros_loader._loaded_srvs = {}
+            ros_loader.clear_cache()
             self.assertNotEqual(ros_loader.get_service_class(x), None)
             self.assertNotEqual(ros_loader.get_service_request_instance(x), None)
             self.assertNotEqual(ros_loader.get_service_response_instance(x), None)